@@ -2,23 +2,25 @@ import argparse
 import asyncio
 import logging
 import os
-import sys
-from xml.etree import ElementTree
+from typing import List
 
-import requests
+import aiohttp
+from crawl4ai import (AsyncWebCrawler, BrowserConfig, CacheMode,
+                      CrawlerRunConfig, CrawlResult)
+from lxml import etree
 
 __location__ = os.path.dirname(os.path.abspath(__file__))
 __output__ = os.path.join(__location__, "output")
+_OUTPUT_PREFIX = __output__ + os.sep
 logger = logging.getLogger(__name__)
 
-# Append parent directory to system path
-parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(parent_dir)
+# Maps URL path characters to filename-safe ones in a single pass
+_FILENAME_TRANS = str.maketrans({"/": "_", ".": "_", ":": "_"})
 
-from typing import List
-
-from crawl4ai import (AsyncWebCrawler, BrowserConfig, CacheMode,
-                      CrawlerRunConfig, CrawlResult)
+# Compiled once; evaluating it returns the <loc> text nodes directly
+_LOC_XPATH = etree.XPath(
+    "//s:loc/text()", namespaces={"s": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+)
 
 
 async def _crawl_parallel(urls: List[str], html_output: bool, max_concurrent: int = 3):
@@ -36,34 +38,65 @@ async def _crawl_parallel(urls: List[str], html_output: bool, max_concurrent: in
     crawler = AsyncWebCrawler(config=browser_config)
     await crawler.start()
 
-    try:
-        # We'll chunk the URLs in batches of 'max_concurrent'
-        success_count = 0
-        fail_count = 0
-        for i in range(0, len(urls), max_concurrent):
-            batch = urls[i : i + max_concurrent]
-            tasks = []
-
-            for j, url in enumerate(batch):
-                # Unique session_id per concurrent sub-task
-                session_id = f"parallel_session_{i + j}"
-                task = crawler.arun(url=url, config=crawl_config, session_id=session_id)
-                tasks.append(task)
-
-            # Gather results
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            # Evaluate results
-            for url, result in zip(batch, results):
-                assert isinstance(result, (Exception, CrawlResult))
-                if isinstance(result, Exception):
-                    logger.critical("Error crawling %s: %s", url, result)
-                    fail_count += 1
-                elif result.success:
+    success_count = 0
+    fail_count = 0
+
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    write_queue: asyncio.Queue[CrawlResult] = asyncio.Queue()
+
+    async def _writer():
+        # Drain whatever has accumulated and write it in one thread hop,
+        # amortizing the per-file thread dispatch and syscall overhead
+        while True:
+            results = [await write_queue.get()]
+            while not write_queue.empty():
+                results.append(write_queue.get_nowait())
+            try:
+                await asyncio.to_thread(_save_results_to_result_dir, results, html_output)
+            except Exception:
+                # The writer must outlive a failed batch, or queue.join()
+                # would wait forever on the items it never acknowledged
+                logger.exception("Error saving batch of %s results", len(results))
+            finally:
+                for _ in results:
+                    write_queue.task_done()
+
+    async def _worker(worker_idx: int):
+        nonlocal success_count, fail_count
+
+        # One session_id per worker so its browser context is reused
+        # across every URL the worker handles
+        session_id = f"parallel_session_{worker_idx}"
+        while True:
+            url = await queue.get()
+            try:
+                result = await crawler.arun(url=url, config=crawl_config, session_id=session_id)
+            except Exception as e:
+                logger.critical("Error crawling %s: %s", url, e)
+                fail_count += 1
+            else:
+                if result.success:
                     success_count += 1
-                    _save_markdown_to_result_dir(result, html_output)
+                    write_queue.put_nowait(result)
                 else:
                     fail_count += 1
+            finally:
+                queue.task_done()
+
+    try:
+        # Workers pull URLs continuously, so a slow page never holds up
+        # the other slots the way fixed-size batches did
+        workers = [asyncio.create_task(_worker(i)) for i in range(max_concurrent)]
+        writer = asyncio.create_task(_writer())
+        await queue.join()
+        await write_queue.join()
+        for worker in workers:
+            worker.cancel()
+        writer.cancel()
+        await asyncio.gather(*workers, writer, return_exceptions=True)
 
         logger.info("\nSummary:")
         logger.info("  - Successfully crawled: %s", success_count)
@@ -74,6 +107,22 @@ async def _crawl_parallel(urls: List[str], html_output: bool, max_concurrent: in
         await crawler.close()
 
 
+def _save_results_to_result_dir(results: List[CrawlResult], html_output: bool):
+    """
+    Saves a batch of crawl results back-to-back.
+
+    Args:
+        results (List[CrawlResult]): The crawl results to save
+    """
+    for result in results:
+        try:
+            _save_markdown_to_result_dir(result, html_output)
+        except Exception:
+            # One unwritable result (e.g. a filename over the filesystem
+            # limit) must not discard the rest of the batch
+            logger.exception("Error saving result for %s", result.url)
+
+
 def _save_markdown_to_result_dir(result: CrawlResult, html_output: bool):
     """
     Saves the markdown content to a file in the output directory.
@@ -82,41 +131,50 @@ def _save_markdown_to_result_dir(result: CrawlResult, html_output: bool):
         result (CrawlResult): The crawl result
     """
     # Convert result.url to a filename
-    filename = result.url.replace("https://", "").replace("/", "_").replace(".", "_")
+    filename = result.url.split("://", 1)[-1].translate(_FILENAME_TRANS)
 
+    # Encode once in bulk and write bytes, skipping TextIOWrapper's
+    # incremental encoder
     if html_output:
         if result.html:
             # Save the html content to a file
-            output_file = os.path.join(__output__, f"{filename}.html")
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(result.html)  # pyright: ignore [reportArgumentType]
+            output_file = f"{_OUTPUT_PREFIX}{filename}.html"
+            with open(output_file, "wb") as f:
+                f.write(result.html.encode("utf-8", errors="replace"))
     else:
         if result.markdown:
             # Save the markdown content to a file
-            output_file = os.path.join(__output__, f"{filename}.md")
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(result.markdown)  # pyright: ignore [reportArgumentType]
+            output_file = f"{_OUTPUT_PREFIX}{filename}.md"
+            with open(output_file, "wb") as f:
+                f.write(result.markdown.encode("utf-8", errors="replace"))  # pyright: ignore [reportAttributeAccessIssue]
 
 
-def _get_urls_to_crawl(sitemap_url: str) -> list[str]:
+async def _get_urls_to_crawl(sitemap_url: str, session: aiohttp.ClientSession) -> list[str]:
     """
     Fetches all URLs from the sitemap.
 
     Returns:
         List[str]: List of URLs
     """
-    namespace = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-
     try:
-        response = requests.get(sitemap_url)
-        response.raise_for_status()
-
-        # Parse the XML
-        root = ElementTree.fromstring(response.content)
-
-        # Extract all URLs from the sitemap
-        urls = [loc.text for loc in root.findall(".//ns:loc", namespace) if loc.text]
-        logger.info(f"Found %s URLs in sitemap", len(urls))
+        async with session.get(sitemap_url) as response:
+            response.raise_for_status()
+
+            # Stream-parse the XML, discarding each <loc> element once its text
+            # has been collected so large sitemaps never live in memory whole
+            parser = etree.XMLPullParser(
+                events=("end",), tag="{http://www.sitemaps.org/schemas/sitemap/0.9}loc"
+            )
+            urls: list[str] = []
+            async for chunk in response.content.iter_chunked(1 << 16):
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.text:
+                        urls.append(elem.text)
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        logger.info("Found %s URLs in sitemap", len(urls))
 
         return urls
     except Exception as e:
@@ -124,27 +182,29 @@ def _get_urls_to_crawl(sitemap_url: str) -> list[str]:
         return []
 
 
-def _get_child_sitemaps(base_sitemap_url: str) -> list[str]:
+async def _get_child_sitemaps(base_sitemap_url: str, session: aiohttp.ClientSession) -> list[str]:
     """
     Fetches all child sitemaps from the base URL's sitemap.
 
     Returns:
         List[str]: List of URLs for all child sitemaps
     """
-    namespace = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-
     try:
-        response = requests.get(base_sitemap_url)
-        response.raise_for_status()
+        async with session.get(base_sitemap_url) as response:
+            response.raise_for_status()
 
-        # Parse the XML
-        root = ElementTree.fromstring(response.content)
+            # Feed the body into libxml2 chunk by chunk rather than
+            # buffering a full bytes copy in the Python heap first
+            parser = etree.XMLParser()
+            async for chunk in response.content.iter_chunked(1 << 16):
+                parser.feed(chunk)
+            root = parser.close()
 
         # Check if the sitemap has child sitemaps
         if not root.tag.endswith("sitemapindex"):
             return [base_sitemap_url]
 
-        urls = [loc.text for loc in root.findall(".//ns:loc", namespace) if loc.text]
+        urls = [str(loc) for loc in _LOC_XPATH(root)]
         logger.info("Found %s child sitemaps", len(urls))
         return urls
     except Exception as e:
@@ -173,16 +233,28 @@ def _parse_command_line() -> argparse.Namespace:
 
 async def main():
     args = _parse_command_line()
-    child_sitemaps = _get_child_sitemaps(args.sitemap_url)
 
-    urls: list[str] = []
-    for child_sitemap in child_sitemaps:
-        urls.extend(_get_urls_to_crawl(child_sitemap))
+    # One pooled session across both phases so child-sitemap fetches reuse
+    # keep-alive connections and run concurrently
+    connector = aiohttp.TCPConnector(limit=32)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        child_sitemaps = await _get_child_sitemaps(args.sitemap_url, session)
+        url_lists = await asyncio.gather(
+            *(_get_urls_to_crawl(child_sitemap, session) for child_sitemap in child_sitemaps)
+        )
+
+    all_urls = [url for url_list in url_lists for url in url_list]
+
+    # Child sitemaps often overlap; dedupe in order so no URL is
+    # fetched and rendered twice
+    urls: list[str] = list(dict.fromkeys(all_urls))
+    if len(urls) < len(all_urls):
+        logger.info("Removed %s duplicate URLs", len(all_urls) - len(urls))
 
     if urls:
         # Create the output directory if it doesn't exist
-        if not os.path.exists(__output__):
-            os.makedirs(__output__)
+        os.makedirs(__output__, exist_ok=True)
 
         logger.info("Found %s URLs to crawl", len(urls))
         await _crawl_parallel(urls, args.html_output, max_concurrent=10)